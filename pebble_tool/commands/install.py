@@ -1,16 +1,17 @@
 
 __author__ = 'katharine'
 
-import errno
 import os
 import os.path
+import select
 import signal
+import sys
+import time
 from progressbar import ProgressBar, Bar, FileTransferSpeed, Timer, Percentage
 
 from libpebble2.communication.transports.websocket import WebsocketTransport, MessageTargetPhone
 from libpebble2.communication.transports.websocket.protocol import WebSocketInstallBundle, WebSocketInstallStatus
 from libpebble2.exceptions import TimeoutError
-from libpebble2.services.install import AppInstaller
 
 from .base import PebbleCommand
 from ..util.logs import PebbleLogPrinter
@@ -40,26 +41,42 @@ class InstallCommand(PebbleCommand):
     def _kill_emulators(self):
         """Kill all running emulators to ensure a fresh state."""
         info = emu_module.get_all_emulator_info()
-        killed_any = False
-        for platform in list(info.values()):
-            for version in list(platform.values()):
-                killed_any |= self._kill_if_running(version['qemu']['pid'])
-                killed_any |= self._kill_if_running(version['pypkjs']['pid'])
-                if 'websockify' in version:
-                    killed_any |= self._kill_if_running(version['websockify']['pid'])
-        if killed_any:
+        killed = []
+        for platform in info.values():
+            for version in platform.values():
+                killed.extend(emu_module.signal_emulator(version, signal.SIGTERM))
+        if killed:
+            self._wait_for_exit(killed)
             print("Killed emulator for fresh install.")
 
     @classmethod
-    def _kill_if_running(cls, pid):
-        """Kill a process if it's running. Returns True if killed."""
+    def _wait_for_exit(cls, pids, timeout=5):
+        """Wait, up to a shared deadline, for all of the given processes to exit."""
+        if not hasattr(os, 'pidfd_open'):
+            return
+        fds = []
         try:
-            os.kill(pid, signal.SIGTERM)
-            return True
-        except OSError as e:
-            if e.errno == errno.ESRCH:
-                return False
-            raise
+            for pid in pids:
+                try:
+                    fds.append(os.pidfd_open(pid))
+                except OSError:
+                    # Already gone, or pidfd isn't supported by this kernel.
+                    pass
+            poller = select.poll()
+            for fd in fds:
+                poller.register(fd, select.POLLIN)
+            remaining = set(fds)
+            deadline = time.monotonic() + timeout
+            while remaining:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                for fd, _ in poller.poll(wait * 1000):
+                    poller.unregister(fd)
+                    remaining.discard(fd)
+        finally:
+            for fd in fds:
+                os.close(fd)
 
     @classmethod
     def add_parser(cls, parser):
@@ -71,12 +88,72 @@ class InstallCommand(PebbleCommand):
         return parser
 
 
+class _ThrottledWidgetMixin(object):
+    """Makes a progressbar widget recompute its text at most every _interval seconds, reusing it in between."""
+    _interval = 0.25
+
+    def __init__(self, *args, **kwargs):
+        super(_ThrottledWidgetMixin, self).__init__(*args, **kwargs)
+        self._last_computed = None
+        self._cached = None
+
+    def _cached_render(self, compute, progress, *args, **kwargs):
+        now = time.monotonic()
+        if self._last_computed is None or now - self._last_computed >= self._interval or self._is_final(progress):
+            self._cached = compute(progress, *args, **kwargs)
+            self._last_computed = now
+        return self._cached
+
+    @staticmethod
+    def _is_final(progress):
+        # The last render is the line the user keeps, so it must never be stale. progressbar2 >= 3 sets end_time in
+        # finish(); older versions set finished = True. A full bar also counts.
+        if getattr(progress, 'end_time', None) is not None or getattr(progress, 'finished', None) is True:
+            return True
+        value = getattr(progress, 'value', getattr(progress, 'currval', None))
+        max_value = getattr(progress, 'max_value', getattr(progress, 'maxval', None))
+        return isinstance(value, (int, float)) and isinstance(max_value, (int, float)) and value >= max_value
+
+    # progressbar2 >= 3 renders widgets by calling them; older versions call update().
+    def __call__(self, progress, *args, **kwargs):
+        return self._cached_render(super(_ThrottledWidgetMixin, self).__call__, progress, *args, **kwargs)
+
+    def update(self, progress, *args, **kwargs):
+        return self._cached_render(super(_ThrottledWidgetMixin, self).update, progress, *args, **kwargs)
+
+def _throttled(widget_class):
+    return type('Throttled' + widget_class.__name__, (_ThrottledWidgetMixin, widget_class), {})
+
+
+class _NoopBar(object):
+    """Stands in for a ProgressBar when nobody is watching the output."""
+    maxval = None
+
+    def start(self):
+        pass
+
+    def update(self, value):
+        pass
+
+    def finish(self):
+        pass
+
+
 class ToolAppInstaller(object):
     def __init__(self, pebble, pbw=None):
         self.pebble = pebble
         self.pbw = pbw or 'build/{}.pbw'.format(os.path.basename(os.getcwd()))
-        self.progress_bar = ProgressBar(widgets=[Percentage(), Bar(marker='=', left='[', right=']'), ' ',
-                                                 FileTransferSpeed(), ' ', Timer(format='%s')])
+        if sys.stdout.isatty():
+            # The speed and elapsed time are comparatively expensive to format and don't need to change on
+            # every redraw.
+            self.progress_bar = ProgressBar(widgets=[Percentage(), Bar(marker='=', left='[', right=']'), ' ',
+                                                     _throttled(FileTransferSpeed)(), ' ',
+                                                     _throttled(Timer)(format='%s')])
+        else:
+            self.progress_bar = _NoopBar()
+        self._last_update_ts = 0.0
+        self._last_update_sent = 0
+        self._update_interval = 0.1
 
     def install(self):
         if isinstance(self.pebble.transport, WebsocketTransport):
@@ -85,6 +162,7 @@ class ToolAppInstaller(object):
             self._install_via_serial(self.pebble, self.pbw)
 
     def _install_via_serial(self, pebble, pbw):
+        from libpebble2.services.install import AppInstaller
         installer = AppInstaller(pebble, pbw)
         self.progress_bar.maxval = installer.total_size
         self.progress_bar.start()
@@ -93,17 +171,36 @@ class ToolAppInstaller(object):
         self.progress_bar.finish()
 
     def _handle_pp_progress(self, sent, total_sent, total_size):
+        # Redrawing the bar is expensive relative to a single progress callback, so only do it every
+        # _update_interval seconds or every 1% of the transfer, whichever comes first.
+        now = time.monotonic()
+        if total_sent < total_size and now - self._last_update_ts < self._update_interval \
+                and total_sent - self._last_update_sent < total_size / 100:
+            return
+        self._last_update_ts = now
+        self._last_update_sent = total_sent
         self.progress_bar.update(total_sent)
 
     def _install_via_websocket(self, pebble, pbw):
-        with open(pbw, 'rb') as f:
-            print("Installing app...")
-            pebble.transport.send_packet(WebSocketInstallBundle(pbw=f.read()), target=MessageTargetPhone())
-            try:
-                result = pebble.read_transport_message(MessageTargetPhone, WebSocketInstallStatus, timeout=300)
-            except TimeoutError:
-                raise ToolError("Timed out waiting for install confirmation.")
-            if result.status != WebSocketInstallStatus.StatusCode.Success:
-                raise ToolError("App install failed.")
-            else:
-                print("App install succeeded.")
+        # The install bundle protocol carries the whole pbw as a single bytes payload, so it can't be streamed.
+        # Read it in one go, unbuffered since we only read it once, and release the file before we spend up to
+        # five minutes waiting for the phone.
+        with open(pbw, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                except OSError:
+                    # Only a hint; pipes and FIFOs (e.g. `pebble install <(curl ...)`) reject it with ESPIPE.
+                    pass
+            bundle = WebSocketInstallBundle(pbw=f.read())
+        print("Installing app...")
+        pebble.transport.send_packet(bundle, target=MessageTargetPhone())
+        del bundle
+        try:
+            result = pebble.read_transport_message(MessageTargetPhone, WebSocketInstallStatus, timeout=300)
+        except TimeoutError:
+            raise ToolError("Timed out waiting for install confirmation.")
+        if result.status != WebSocketInstallStatus.StatusCode.Success:
+            raise ToolError("App install failed.")
+        else:
+            print("App install succeeded.")
@@ -1,17 +1,19 @@
 
 __author__ = 'katharine'
 
-import errno
-import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import shutil
 import signal
+import sys
 
 from libpebble2.communication import PebbleConnection
 from libpebble2.exceptions import ConnectionError, TimeoutError
 from libpebble2.protocol.apps import AppRunState, AppRunStateRequest
 
 from ..base import BaseCommand, PebbleCommand
-from pebble_tool.exceptions import InvalidProjectException
+from pebble_tool.exceptions import PebbleProjectException
 from pebble_tool.sdk import get_sdk_persist_dir, get_persist_dir, get_pebble_platforms
 from pebble_tool.sdk.project import PebbleProject
 import pebble_tool.sdk.emulator as emulator
@@ -29,20 +31,9 @@ class KillCommand(BaseCommand):
             s = signal.SIGTERM
 
         info = emulator.get_all_emulator_info()
-        for platform in list(info.values()):
-            for version in list(platform.values()):
-                self._kill_if_running(version['qemu']['pid'], s)
-                self._kill_if_running(version['pypkjs']['pid'], s)
-                if 'websockify' in version:
-                    self._kill_if_running(version['websockify']['pid'], s)
-
-    @classmethod
-    def _kill_if_running(cls, pid, signal_number):
-        try:
-            os.kill(pid, signal_number)
-        except OSError as e:
-            if e.errno == errno.ESRCH:
-                pass
+        for platform in info.values():
+            for version in platform.values():
+                emulator.signal_emulator(version, s)
 
     @classmethod
     def add_parser(cls, parser):
@@ -60,8 +51,10 @@ class WipeCommand(BaseCommand):
         if args.everything:
             shutil.rmtree(get_persist_dir())
         else:
-            for platform in get_pebble_platforms():
-                shutil.rmtree(get_sdk_persist_dir(platform))
+            # Removing each platform's persist dir is dominated by filesystem calls, so let them overlap.
+            dirs = [get_sdk_persist_dir(platform) for platform in get_pebble_platforms()]
+            with ThreadPoolExecutor(max_workers=len(dirs) or 1) as executor:
+                list(executor.map(shutil.rmtree, dirs))
 
     @classmethod
     def add_parser(cls, parser):
@@ -71,6 +64,34 @@ class WipeCommand(BaseCommand):
         return parser
 
 
+@contextmanager
+def _pypkjs_connection(port):
+    """Yield a connected PebbleConnection to the pypkjs instance on the given port, disconnecting it on exit."""
+    connection = PebbleConnection(emulator.WebsocketTransport('ws://localhost:{}/'.format(port)))
+    connection.connect()
+    connection.run_async()
+    try:
+        yield connection
+    finally:
+        connection.disconnect()
+
+
+# Shared stand-in for missing sections of the emulator info; never mutated.
+_NO_INFO = {}
+
+# Process status lines, indexed by (qemu_alive << 1) | pypkjs_alive
+_STATUS_TEMPLATES = tuple("\n".join(lines) for lines in (
+    ("Status: STOPPED", "  QEMU:   not running (was pid {q})", "  pypkjs: not running (was pid {p})"),
+    ("Status: DEGRADED (QEMU not running)", "  QEMU:   NOT RUNNING (was pid {q})", "  pypkjs: running (pid {p})"),
+    ("Status: DEGRADED (pypkjs not running)", "  QEMU:   running (pid {q})", "  pypkjs: NOT RUNNING (was pid {p})"),
+    ("Status: RUNNING", "  QEMU:   running (pid {q})", "  pypkjs: running (pid {p})"),
+))
+
+ProcessStatus = collections.namedtuple(
+    'ProcessStatus', 'qemu_pid qemu_alive pypkjs_pid pypkjs_alive vnc websockify_pid websockify_alive')
+AppStatus = collections.namedtuple('AppStatus', 'state uuid error')
+
+
 class StatusCommand(BaseCommand):
     """Shows the status of running emulators and installed apps."""
     command = 'status'
@@ -79,120 +100,136 @@ class StatusCommand(BaseCommand):
         super(StatusCommand, self).__call__(args)
 
         all_info = emulator.get_all_emulator_info()
+        emulators = [(platform, version, info)
+                     for platform, versions in all_info.items()
+                     for version, info in versions.items()]
 
-        if not all_info:
+        if not emulators:
             print("No emulators have been started.")
             return
 
-        found_any = False
-        for platform, versions in all_info.items():
-            for version, info in versions.items():
-                found_any = True
-                self._show_emulator_status(platform, version, info, args.verbose)
-
-        if not found_any:
-            print("No emulators have been started.")
+        processes = [self._check_processes(info) for platform, version, info in emulators]
 
-    def _show_emulator_status(self, platform, version, info, verbose):
-        """Display status for a single emulator instance."""
-        qemu_pid = info.get('qemu', {}).get('pid')
-        pypkjs_pid = info.get('pypkjs', {}).get('pid')
+        # Each query can take several seconds if an emulator is wedged, so run them concurrently and
+        # print everything afterwards in a stable order.
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            app_statuses = [executor.submit(self._query_app_status, info)
+                            if process.qemu_alive and process.pypkjs_alive else None
+                            for (platform, version, info), process in zip(emulators, processes)]
+            project_uuid = self._get_project_uuid() if any(app_statuses) else None
 
-        qemu_alive = qemu_pid and emulator.ManagedEmulatorTransport._is_pid_running(qemu_pid)
-        pypkjs_alive = pypkjs_pid and emulator.ManagedEmulatorTransport._is_pid_running(pypkjs_pid)
+        for (platform, version, info), process, app_status in zip(emulators, processes, app_statuses):
+            self._show_emulator_status(platform, version, process,
+                                       app_status and app_status.result(), project_uuid, args.verbose)
 
-        print("\n=== Emulator: {} (SDK {}) ===".format(platform, version))
+    @classmethod
+    def _check_processes(cls, info):
+        """Check whether each of an emulator's processes is still alive."""
+        qemu = info.get('qemu', _NO_INFO)
+        qemu_pid = qemu.get('pid')
+        pypkjs_pid = info.get('pypkjs', _NO_INFO).get('pid')
+        vnc = bool(qemu.get('vnc'))
+        websockify_pid = info.get('websockify', _NO_INFO).get('pid') if vnc else None
+
+        # Check each process exactly once; the results are reused when printing.
+        return ProcessStatus(
+            qemu_pid=qemu_pid,
+            qemu_alive=bool(qemu_pid) and emulator.is_pid_running(qemu_pid),
+            pypkjs_pid=pypkjs_pid,
+            pypkjs_alive=bool(pypkjs_pid) and emulator.is_pid_running(pypkjs_pid),
+            vnc=vnc,
+            websockify_pid=websockify_pid,
+            websockify_alive=bool(websockify_pid) and emulator.is_pid_running(websockify_pid),
+        )
+
+    def _show_emulator_status(self, platform, version, process, app_status, project_uuid, verbose):
+        """Display status for a single emulator instance."""
+        lines = ["\n=== Emulator: {} (SDK {}) ===".format(platform, version)]
 
         # Process status
-        if qemu_alive and pypkjs_alive:
-            print("Status: RUNNING")
-            print("  QEMU:   running (pid {})".format(qemu_pid))
-            print("  pypkjs: running (pid {})".format(pypkjs_pid))
-        elif qemu_alive and not pypkjs_alive:
-            print("Status: DEGRADED (pypkjs not running)")
-            print("  QEMU:   running (pid {})".format(qemu_pid))
-            print("  pypkjs: NOT RUNNING (was pid {})".format(pypkjs_pid))
-        elif not qemu_alive and pypkjs_alive:
-            print("Status: DEGRADED (QEMU not running)")
-            print("  QEMU:   NOT RUNNING (was pid {})".format(qemu_pid))
-            print("  pypkjs: running (pid {})".format(pypkjs_pid))
-        else:
-            print("Status: STOPPED")
-            print("  QEMU:   not running (was pid {})".format(qemu_pid))
-            print("  pypkjs: not running (was pid {})".format(pypkjs_pid))
-            return  # No point checking app status if emulator is stopped
-
-        # VNC status
-        if info.get('qemu', {}).get('vnc'):
-            websockify_pid = info.get('websockify', {}).get('pid')
-            if websockify_pid and emulator.ManagedEmulatorTransport._is_pid_running(websockify_pid):
-                print("  VNC:    enabled (websockify pid {})".format(websockify_pid))
+        state = (int(process.qemu_alive) << 1) | int(process.pypkjs_alive)
+        lines.append(_STATUS_TEMPLATES[state].format(q=process.qemu_pid, p=process.pypkjs_pid))
+
+        # VNC status; no point reporting anything else if the emulator is stopped
+        if state != 0 and process.vnc:
+            if process.websockify_alive:
+                lines.append("  VNC:    enabled (websockify pid {})".format(process.websockify_pid))
             else:
-                print("  VNC:    enabled but websockify not running")
+                lines.append("  VNC:    enabled but websockify not running")
 
-        # Try to get app status
-        if qemu_alive and pypkjs_alive:
-            self._show_app_status(info, verbose)
+        # app_status is only queried for emulators that are fully running
+        if app_status is not None:
+            self._show_app_status(app_status, project_uuid, verbose, lines)
 
-    def _show_app_status(self, info, verbose):
-        """Query and display the currently running app status."""
-        pypkjs_port = info.get('pypkjs', {}).get('port')
+        # Write the whole block at once rather than a line at a time.
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    def _query_app_status(self, info):
+        """Ask an emulator which app it is currently running."""
+        pypkjs_port = info.get('pypkjs', _NO_INFO).get('port')
         if not pypkjs_port:
-            print("  App:    unable to query (no pypkjs port)")
-            return
+            return AppStatus('no-port', None, None)
 
         try:
-            transport = emulator.WebsocketTransport('ws://localhost:{}/'.format(pypkjs_port))
-            connection = PebbleConnection(transport)
-            connection.connect()
-            connection.run_async()
-
-            # Query app run state
-            try:
+            with _pypkjs_connection(pypkjs_port) as connection:
+                # Query app run state
                 response = connection.send_and_read(
                     AppRunState(data=AppRunStateRequest()),
                     AppRunState,
                     timeout=5
                 )
-                app_uuid = response.data.uuid
-
+            return AppStatus('running', response.data.uuid, None)
+        except TimeoutError:
+            return AppStatus('timeout', None, None)
+        except ConnectionError as e:
+            return AppStatus('disconnected', None, e)
+        except Exception as e:
+            return AppStatus('unknown', None, e)
+
+    def _show_app_status(self, app_status, project_uuid, verbose, lines):
+        """Append the display of a _query_app_status result to lines."""
+        if app_status.state == 'no-port':
+            lines.append("  App:    unable to query (no pypkjs port)")
+        elif app_status.state == 'running':
+            app_uuid = app_status.uuid
+            if app_uuid:
+                uuid_str = str(app_uuid)
                 # Check if this matches the current project
-                project_match = self._check_project_match(app_uuid)
-
-                if app_uuid:
-                    uuid_str = str(app_uuid)
-                    if project_match:
-                        print("  App:    RUNNING ({} - current project)".format(uuid_str))
-                    else:
-                        print("  App:    RUNNING ({})".format(uuid_str))
-                        if verbose:
-                            print("          (not the current project)")
+                if self._check_project_match(app_uuid, project_uuid):
+                    lines.append(f"  App:    RUNNING ({uuid_str} - current project)")
                 else:
-                    print("  App:    no app running (showing watchface)")
-
-            except TimeoutError:
-                print("  App:    UNRESPONSIVE (timed out querying app state)")
-                if verbose:
-                    print("          The app may be stuck in an infinite loop or crashed")
-            finally:
-                connection.disconnect()
-
-        except ConnectionError as e:
-            print("  App:    DISCONNECTED (could not connect to emulator)")
+                    lines.append(f"  App:    RUNNING ({uuid_str})")
+                    if verbose:
+                        lines.append("          (not the current project)")
+            else:
+                lines.append("  App:    no app running (showing watchface)")
+        elif app_status.state == 'timeout':
+            lines.append("  App:    UNRESPONSIVE (timed out querying app state)")
             if verbose:
-                print("          Error: {}".format(str(e)))
-        except Exception as e:
-            print("  App:    UNKNOWN (error querying status)")
+                lines.append("          The app may be stuck in an infinite loop or crashed")
+        elif app_status.state == 'disconnected':
+            lines.append("  App:    DISCONNECTED (could not connect to emulator)")
+            if verbose:
+                lines.append(f"          Error: {app_status.error}")
+        else:
+            lines.append("  App:    UNKNOWN (error querying status)")
             if verbose:
-                print("          Error: {}".format(str(e)))
+                lines.append(f"          Error: {app_status.error}")
 
-    def _check_project_match(self, app_uuid):
-        """Check if the running app matches the current project."""
+    def _get_project_uuid(self):
+        """Return the UUID of the project in the current directory, if there is one."""
+        # A broken or outdated project only means we can't say whether the running app is ours; it mustn't stop
+        # us reporting on the emulators.
         try:
-            project = PebbleProject()
-            return project.uuid == app_uuid
-        except InvalidProjectException:
-            return False
+            return PebbleProject().uuid
+        except (PebbleProjectException, KeyError, ValueError):
+            # KeyError/ValueError: a required key is missing from appinfo.json, or its uuid is malformed.
+            return None
+
+    def _check_project_match(self, app_uuid, project_uuid):
+        """Check if the running app matches the current project."""
+        # Both are uuid.UUID; comparing the integer values skips UUID.__eq__'s type dispatch.
+        return project_uuid is not None and app_uuid.int == project_uuid.int
 
     @classmethod
     def add_parser(cls, parser):
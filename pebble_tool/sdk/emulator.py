@@ -36,6 +36,99 @@ def _to_text(data):
         return data.decode('utf-8', 'replace')
     return str(data)
 
+def _read_proc_stat(pid):
+    # Returns the fields of /proc/<pid>/stat following the command name, or None if there's no such process.
+    # The command name is parenthesised and may itself contain spaces or parentheses, so split after the last ')'.
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as f:
+            return f.read().rpartition(b')')[2].split()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+
+def _proc_state(pid):
+    # The single-letter process state (b'R', b'S', b'Z', ...), or None if there's no such process.
+    fields = _read_proc_stat(pid)
+    return fields[0] if fields else None
+
+
+def _proc_rss(pid):
+    # The resident set size of the process in bytes, or None if there's no such process.
+    fields = _read_proc_stat(pid)
+    if not fields:
+        return None
+    return int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def is_pid_running(pid):
+    # On Linux, one read of /proc/<pid>/stat tells us whether the process exists and isn't a zombie.
+    if sys.platform.startswith('linux'):
+        state = _proc_state(pid)
+        return state is not None and state != b'Z'
+    # PBL-21228: This isn't going to work on Windows.
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        else:
+            raise
+    return True
+
+
+def _reap_if_exited(pid):
+    # If pid is one of our own children and has already exited, reap it so we don't need to signal it.
+    # Emulators usually outlive the command that spawned them, in which case this is a no-op.
+    if not hasattr(os, 'waitpid') or not hasattr(os, 'WNOHANG'):
+        return False
+    try:
+        wpid, _ = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        return False
+    return wpid == pid
+
+
+def _getpgid(pid):
+    try:
+        return os.getpgid(pid)
+    except OSError:
+        return None
+
+
+def signal_emulator(info, signal_number):
+    """Send a signal to every process of an emulator, given its entry from :func:`get_all_emulator_info`.
+
+    Emulators started as a process group get a single ``os.killpg``; older ones are signalled one pid at a time.
+    Returns the pids that were running and were signalled.
+    """
+    pids = [process['pid'] for process in (info['qemu'], info['pypkjs'], info.get('websockify'))
+            if process is not None]
+    # A dead pid may since have been recycled by something unrelated, so only ever touch ones that are running.
+    alive = [pid for pid in pids if not _reap_if_exited(pid) and is_pid_running(pid)]
+
+    pgid = info['qemu'].get('pgid')
+    if pgid is not None:
+        # Only signal the group if one of our processes is still in it; otherwise the pgid may be stale or reused.
+        members = [pid for pid in alive if _getpgid(pid) == pgid]
+        if not members:
+            return []
+        try:
+            os.killpg(pgid, signal_number)
+        except ProcessLookupError:
+            return []
+        return members
+
+    signalled = []
+    for pid in alive:
+        try:
+            os.kill(pid, signal_number)
+        except (ProcessLookupError, PermissionError):
+            # Exited in the meantime, or the pid now belongs to someone else's process.
+            continue
+        signalled.append(pid)
+    return signalled
+
+
 def get_emulator_info_path():
     return os.path.join(tempfile.gettempdir(), 'pb-emulator.json')
 
@@ -98,6 +191,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
         self.version = version
         self.vnc_enabled = vnc_enabled
         self.websockify_pid = None
+        self.qemu_pgid = None
         self._find_ports()
         super(ManagedEmulatorTransport, self).__init__('ws://localhost:{}/'.format(self.pypkjs_port))
 
@@ -125,6 +219,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
                 self.qemu_serial_port = info['qemu']['serial']
                 self.qemu_pid = info['qemu']['pid']
                 self.qemu_gdb_port = info['qemu'].get('gdb', None)
+                self.qemu_pgid = info['qemu'].get('pgid', None)
             else:
                 # Kill existing QEMU if VNC state doesn't match
                 if self._is_pid_running(info['qemu']['pid']) and existing_vnc != self.vnc_enabled:
@@ -237,6 +332,8 @@ class ManagedEmulatorTransport(WebsocketTransport):
             },
             'version': self.version,
         }
+        if self.qemu_pgid is not None:
+            d['qemu']['pgid'] = self.qemu_pgid
         # Add websockify info if VNC is enabled
         if self.vnc_enabled and self.websockify_pid:
             d['websockify'] = {
@@ -317,7 +414,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
         os.environ["DYLD_FALLBACK_LIBRARY_PATH"] = os.path.join(sdk_manager.root_path_for_sdk(self.version), 'toolchain', 'lib')
 
         logger.info("Qemu command: %s", subprocess.list2cmdline(command))
-        process = subprocess.Popen(command, stdout=self._get_output(), stderr=self._get_output())
+        process = self._popen(command, new_group=True)
         time.sleep(0.2)
         if process.poll() is not None:
             try:
@@ -398,7 +495,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
         ]
         
         logger.info("websockify command: %s", subprocess.list2cmdline(command))
-        process = subprocess.Popen(command, stdout=self._get_output(), stderr=self._get_output())
+        process = self._popen(command)
         time.sleep(0.5)
         if process.poll() is not None:
             try:
@@ -428,7 +525,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
         if logger.getEffectiveLevel() <= logging.DEBUG:
             command.append('--debug')
         logger.info("pypkjs command: %s", subprocess.list2cmdline(command))
-        process = subprocess.Popen(command, stdout=self._get_output(), stderr=self._get_output())
+        process = self._popen(command)
         time.sleep(0.5)
         if process.poll() is not None:
             try:
@@ -438,6 +535,39 @@ class ManagedEmulatorTransport(WebsocketTransport):
                 raise MissingEmulatorError("Couldn't launch pypkjs:\n{}".format(_to_text(out).strip()))
         self.pypkjs_pid = process.pid
 
+    def _popen(self, command, new_group=False):
+        # QEMU leads a process group that pypkjs and websockify then join, so that the whole emulator can be
+        # signalled at once with os.killpg. If that isn't possible, the process is spawned ungrouped and qemu_pgid
+        # is cleared, so the saved state has no pgid and the emulator gets killed one pid at a time instead.
+        output = self._get_output()
+        pgid = 0 if new_group else self.qemu_pgid
+        if pgid is not None and self._can_join_process_group(pgid):
+            try:
+                process = subprocess.Popen(command, stdout=output, stderr=output, process_group=pgid)
+            except PermissionError:
+                # QEMU's group went away or changed session between the check and the spawn.
+                pass
+            else:
+                if new_group:
+                    self.qemu_pgid = process.pid
+                return process
+        self.qemu_pgid = None
+        return subprocess.Popen(command, stdout=output, stderr=output)
+
+    @classmethod
+    def _can_join_process_group(cls, pgid):
+        # Popen only grew process_group in Python 3.11; we don't fall back to preexec_fn, which isn't thread-safe.
+        if os.name != 'posix' or sys.version_info < (3, 11):
+            return False
+        if pgid == 0:
+            return True
+        # setpgid can only join an existing group in our own session; QEMU may have been started from another
+        # terminal, IDE or login.
+        try:
+            return os.getpgid(pgid) == pgid and os.getsid(pgid) == os.getsid(0)
+        except OSError:
+            return False
+
     def _get_output(self):
         if logger.getEffectiveLevel() <= logging.DEBUG:
             return None
@@ -454,15 +584,7 @@ class ManagedEmulatorTransport(WebsocketTransport):
 
     @classmethod
     def _is_pid_running(cls, pid):
-        # PBL-21228: This isn't going to work on Windows.
-        try:
-            os.kill(pid, 0)
-        except OSError as e:
-            if e.errno == 3:
-                return False
-            else:
-                raise
-        return True
+        return is_pid_running(pid)
     
     def _is_websockify_responsive(self):
         """Quick check if websockify is actually responding to HTTP"""